@@ -1,138 +1,272 @@
+import hashlib
+import os
+from collections import OrderedDict
+
 import numpy as np
-import random
+from joblib import Memory
+from joblib.externals.loky import ProcessPoolExecutor
 from sklearn.metrics import f1_score
-from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import StandardScaler
-from sklearn.svm import SVC
+from sklearn.svm import LinearSVC
 from sklearn.model_selection import train_test_split
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = prange = None
+
 
 def marginal_entropy(x):
-    x_counter = {xi: 0 for xi in x}
-    for xi in x:
-        x_counter[xi] += 1
-    probs = np.array(list(map(lambda xi: x_counter[xi] / len(x), x)))
-    nonzero_probs = probs[np.where(probs > 0)]
-    entropy = -sum(nonzero_probs * np.log(nonzero_probs))
-    return entropy
+    x = np.asarray(x)
+    _, counts = np.unique(x, return_counts=True)
+    probs = counts.astype(np.float64) / x.size
+    return -(probs * np.log(probs)).sum()
+
+
+def _encode(x):
+    """ map values of x to dense integer codes 0..k-1 """
+    _, codes = np.unique(np.asarray(x), return_inverse=True)
+    return codes.reshape(-1).astype(np.int32)
+
+
+def _codes_conditional_entropy(x_codes, y_codes):
+    nx, ny = x_codes.max() + 1, y_codes.max() + 1
+    joint = np.bincount(x_codes * ny + y_codes, minlength=nx * ny).reshape(nx, ny)
+    y_counts = joint.sum(axis=0)
+    nonzero = joint > 0
+    probs = joint[nonzero] / np.broadcast_to(y_counts, joint.shape)[nonzero]
+    return -(joint[nonzero] * np.log(probs)).sum() / x_codes.size
 
 
 def conditional_entropy(x, y):
-    y_counter = {yi: 0 for yi in y}
-    x_by_y_counter = {yi: {xi: 0 for xi in x} for yi in y}
-    for i in range(len(x)):
-        xi = x[i]
-        yi = y[i]
-        y_counter[yi] += 1
-        x_by_y_counter[yi][xi] += 1
-    entropy = 0.
-    for yi in y_counter.keys():
-        x_yi = x_by_y_counter[yi].values()
-        x_by_yi = np.array(list(map(lambda xi: xi / y_counter[yi], x_yi)))
-        nonzero_probs = x_by_yi[np.where(x_by_yi > 0)]
-        yi_entropy = -sum(nonzero_probs * np.log(nonzero_probs))
-        entropy += (y_counter[yi] / len(y)) * yi_entropy
-    return entropy
+    return _codes_conditional_entropy(_encode(x), _encode(y))
 
 
 def mutual_information(x, y):
     return marginal_entropy(x) - conditional_entropy(x, y)
 
 
+def _mi_matrix_numpy(codes, cards, entropies):
+    g_num = len(codes)
+    mi_matrix = np.zeros((g_num, g_num))
+    for i in range(g_num):
+        for j in range(i + 1, g_num):
+            mi_matrix[i, j] = mi_matrix[j, i] = entropies[i] - _codes_conditional_entropy(codes[i], codes[j])
+    return mi_matrix
+
+
+def _mi_matrix_kernel(codes, cards, entropies, rows, cols):
+    """ fused joint histogram + conditional entropy over the upper triangle of pairs """
+    g_num, n = codes.shape
+    mi_matrix = np.zeros((g_num, g_num))
+    for p in prange(len(rows)):
+        i, j = rows[p], cols[p]
+        ny = cards[j]
+        counts = np.zeros(cards[i] * ny, np.int64)
+        y_counts = np.zeros(ny, np.int64)
+        for k in range(n):
+            counts[codes[i, k] * ny + codes[j, k]] += 1
+            y_counts[codes[j, k]] += 1
+        entropy = 0.
+        for a in range(cards[i]):
+            for b in range(ny):
+                c = counts[a * ny + b]
+                if c > 0:
+                    entropy -= c * np.log(c / y_counts[b])
+        mi = entropies[i] - entropy / n
+        mi_matrix[i, j] = mi
+        mi_matrix[j, i] = mi
+    return mi_matrix
+
+
+if njit is not None:
+    _mi_matrix_kernel = njit(parallel=True, cache=True)(_mi_matrix_kernel)
+
+    def _mi_matrix(codes, cards, entropies):
+        rows, cols = np.triu_indices(len(codes), 1)
+        return _mi_matrix_kernel(codes, cards, entropies, rows, cols)
+else:
+    _mi_matrix = _mi_matrix_numpy
+
+
 def genes_mutual_information(genes):
     """
     :param genes: dataset
     :return: mutual information for every gene in dataset
     """
     g_num, _ = genes.shape  # number of features
-    mi_matrix = np.zeros((g_num, g_num))
-    for i in range(g_num):
-        for j in range(g_num):
-            if i != j:
-                mi_matrix[i][j] = mutual_information(genes[i], genes[j])
-    mi_vector = [sum(mi_matrix[i]) for i in range(g_num)]
+    codes = np.array([_encode(genes[i]) for i in range(g_num)])
+    cards = (codes.max(axis=1) + 1).astype(np.int32)
+    entropies = np.array([marginal_entropy(codes[i]) for i in range(g_num)])
+    mi_matrix = _mi_matrix(codes, cards, entropies)
+    mi_vector = mi_matrix.sum(axis=1)
     return mi_vector
 
 
+def discretize_genes(genes, n_bins):
+    """
+    :param genes: dataset, features are rows
+    :param n_bins: number of equal-frequency bins for every gene
+    :return: dataset with every gene replaced by its bin numbers
+    """
+    edges = np.quantile(genes, np.linspace(0, 1, n_bins + 1)[1:-1], axis=1)
+    return np.stack([np.digitize(genes[i], edges[:, i]) for i in range(len(genes))]) \
+        .astype(np.min_scalar_type(n_bins - 1))
+
+
+def _array_key(x):
+    """ content hash of an array, including its shape and dtype """
+    x = np.ascontiguousarray(x)
+    digest = hashlib.blake2b(x.tobytes(), digest_size=16)
+    digest.update(str((x.shape, x.dtype.str)).encode())
+    return digest.digest()
+
+
 def decode_genes(mapping, chromosome, train, test):
     """
+    :param mapping: array of initial dataset indexes for every chromosome position
     :param chromosome: binary vector of feature presence
-    :param train: train set of initial dataset
-    :param test: test set of initial dataset
+    :param train: train set of initial dataset, samples are rows
+    :param test: test set of initial dataset, samples are rows
     :return: decoded train and test sets (reduced)
     """
-    filtered_train, filtered_test = [], []
-    for i in range(len(chromosome)):
-        if chromosome[i] == 1:
-            initial_index = mapping[i]
-            filtered_train.append(train[initial_index])
-            filtered_test.append(test[initial_index])
-    return np.array(filtered_train), np.array(filtered_test)
+    selected = mapping[np.asarray(chromosome, dtype=bool)]
+    return train[:, selected], test[:, selected]
 
 
-def population_fitness(mapping, population, train, train_cl, test, test_cl):
+def _eval_chromosome(context, chromosome, clf):
+    """
+    :param context: (mapping, train, train_cl, test, test_cl) tuple, train and test are standardized
+    :param chromosome: binary vector of feature presence
+    :param clf: classifier to refit on the decoded train set
+    :return: (chromosome, fitness) pair, fitness is None for an empty chromosome
+    """
+    mapping, train, train_cl, test, test_cl = context
+    filtered_train, filtered_test = decode_genes(mapping, chromosome, train, test)
+    if filtered_train.shape[1] == 0:
+        return chromosome, None
+    clf.fit(filtered_train, train_cl)
+    predicted_classes = clf.predict(filtered_test)
+    return chromosome, f1_score(test_cl, predicted_classes, zero_division=0)
+
+
+_worker_context = None
+_worker_clf = None
+
+
+def _init_worker(context):
+    global _worker_context, _worker_clf
+    _worker_context = context
+    _worker_clf = LinearSVC()
+
+
+def _eval_in_worker(chromosome):
+    return _eval_chromosome(_worker_context, chromosome, _worker_clf)
+
+
+def _make_pool(n_jobs, context):
+    """ pool of fitness workers, the read-only context is sent once per worker """
+    return ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(context,))
+
+
+def _chromosome_key(chromosome):
+    return np.asarray(chromosome, dtype=np.uint8).tobytes()
+
+
+def population_fitness(mapping, population, train, train_cl, test, test_cl, pool=None, cache=None,
+                       cache_size=4096, scores=None, reject_percentile=None):
     """
     :param population: vector of chromosomes
-    :return: vector of (chromosome code, chromosome fitness), max fitness, average fitness
+    :param pool: executor initialized with the same context, chromosomes are evaluated
+                 sequentially if None
+    :param cache: OrderedDict from chromosome key to fitness, must only be shared between
+                  calls with the same train/test split
+    :param cache_size: maximum number of fitness values kept in cache
+    :param scores: surrogate score of every chromosome position (e.g. MI of the feature)
+    :param reject_percentile: chromosomes whose total surrogate score is below this percentile
+                              of the population are rejected without training
+    :return: vector of (chromosome code, chromosome fitness) in population order, max fitness,
+             average fitness, vector of rejected chromosomes
     """
-    code_fitness = []
-    f_sum = 0
-    for i in range(len(population)):
-        filtered_train, filtered_test = decode_genes(mapping, population[i], train, test)
-        clf = make_pipeline(StandardScaler(), SVC(gamma='auto'))
-        if len(filtered_train) == 0:
-            continue
-        clf.fit(filtered_train.transpose(), train_cl)
-        predicted_classes = clf.predict(filtered_test.transpose())
-        f = f1_score(test_cl, predicted_classes)
-        code_fitness.append((population[i], f))
-        f_sum += f
-    code_fitness.sort(key=lambda p: p[1], reverse=True)
-    f_max = code_fitness[0][1]
-    f_avg = f_sum / len(population)
-    return code_fitness, f_max, f_avg
-
-
-def crossover(x, y):
-    """ simple one-point crossover """
-    random_point = random.randint(1, len(x) - 1)
-    return x[0:random_point] + y[random_point:len(x)], \
-           y[0:random_point] + x[random_point:len(x)]
-
-
-def mutation(x):
-    """ simple one-bit-inverse mutation """
-    random_point = random.randint(0, len(x) - 1)
-    x[random_point] = (x[random_point] - 1) % 2
+    if cache is None:
+        cache = OrderedDict()
+    keys = [_chromosome_key(chromosome) for chromosome in population]
+    fitness, missed, rejected = {}, {}, set()
+    for key, chromosome in zip(keys, population):
+        if key in cache:
+            cache.move_to_end(key)
+            fitness[key] = cache[key]
+        else:
+            missed.setdefault(key, chromosome)
+    if scores is not None and reject_percentile is not None and len(missed) > 0:
+        population_scores = np.asarray(population, dtype=np.float64) @ scores
+        threshold = np.percentile(population_scores, reject_percentile)
+        for key, chromosome in list(missed.items()):
+            if np.any(chromosome) and scores @ chromosome < threshold:
+                rejected.add(key)
+                del missed[key]
+    if pool is None:
+        context = (mapping, train, train_cl, test, test_cl)
+        clf = LinearSVC()
+        results = [_eval_chromosome(context, chromosome, clf) for chromosome in missed.values()]
+    else:
+        results = pool.map(_eval_in_worker, missed.values())
+    for key, (_, f) in zip(missed.keys(), results):
+        fitness[key] = cache[key] = f  # rejected chromosomes are not cached to be revisited later
+    code_fitness = [(chromosome, fitness[key]) for key, chromosome in zip(keys, population)
+                    if key not in rejected and fitness[key] is not None]
+    rejected_chromosomes = [chromosome for key, chromosome in zip(keys, population) if key in rejected]
+    while len(cache) > cache_size:
+        cache.popitem(last=False)
+    f_sum = sum(f for _, f in code_fitness)
+    f_max = max(f for _, f in code_fitness)
+    f_avg = f_sum / (len(population) - len(rejected_chromosomes))
+    return code_fitness, f_max, f_avg, rejected_chromosomes
+
+
+def crossover(x, y, points):
+    """ simple one-point crossover of every (x[i], y[i]) pair at points[i] """
+    mask = np.arange(x.shape[1]) < points[:, None]
+    return np.where(mask, x, y), np.where(mask, y, x)
+
+
+def mutation(x, points):
+    """ simple one-bit-inverse mutation of every x[i] at points[i] """
+    x = x.copy()
+    x[np.arange(len(x)), points] ^= 1
     return x
 
 
-def cross_and_mutate(pc, pm, population):
+def cross_and_mutate(pc, pm, population, rng=None):
     """
     :param pc: crossover probability
     :param pm: mutation probability
     :param population: (chromosome code, chromosome fitness) pairs
+    :param rng: numpy random Generator, a fresh one is created if None
     :return: (new population, maximum parents' fitness) pair
     """
+    if rng is None:
+        rng = np.random.default_rng()
     cross_number = int(pc * len(population))
     mutate_number = int(pm * len(population))
-    max_parent_f = 0
-    new_population = list(map(lambda x: x[0], population))
-    for i in range(cross_number):
-        parent1, f1 = population[random.randint(0, len(population) - 1)]
-        parent2, f2 = population[random.randint(0, len(population) - 1)]
-        child1, child2 = crossover(parent1, parent2)
-        new_population.extend([child1, child2])
-        max_parent_f = max([max_parent_f, f1, f2])
-    for i in range(mutate_number):
-        mutant = mutation(population[random.randint(0, len(population) - 1)][0])
-        new_population.append(mutant)
-    return new_population, max_parent_f
+    chromosomes = np.array([x[0] for x in population])
+    fitness = np.array([x[1] for x in population])
+    _, size = chromosomes.shape
+    parents1 = rng.integers(0, len(population), size=cross_number)
+    parents2 = rng.integers(0, len(population), size=cross_number)
+    child1, child2 = crossover(chromosomes[parents1], chromosomes[parents2],
+                               rng.integers(1, size, size=cross_number))
+    max_parent_f = max(0, fitness[parents1].max(), fitness[parents2].max()) if cross_number > 0 else 0
+    mutants = mutation(chromosomes[rng.integers(0, len(population), size=mutate_number)],
+                       rng.integers(0, size, size=mutate_number))
+    new_population = np.concatenate((chromosomes, child1, child2, mutants))
+    return list(new_population), max_parent_f
 
 
 class MIMAGA(object):
 
-    def __init__(self, mim_size, pop_size, max_iter, f_target, k1, k2, k3, k4):
+    def __init__(self, mim_size, pop_size, max_iter, f_target, k1, k2, k3, k4, n_jobs=None, seed=None,
+                 reject_percentile=None, revisit_every=5, memory=None, n_bins=32):
         """
         :param mim_size: desirable number of filtered features after MIM
         :param pop_size: initial population size
@@ -142,6 +276,16 @@ class MIMAGA(object):
         :param k2: consts to determine crossover probability
         :param k3: consts to determine mutation probability
         :param k4: consts to determine mutation probability
+        :param n_jobs: number of processes to evaluate fitness in, all cores if None
+        :param seed: seed of train/test split and genetic operators
+        :param reject_percentile: chromosomes with sum of MI of selected features below this
+                                  percentile of population are kept aside without training until
+                                  the next revisit generation, None to train on every chromosome
+        :param revisit_every: every revisit_every-th generation is evaluated without rejection
+        :param memory: joblib.Memory or path to cache MI of genes on disk between runs,
+                       MI is only cached in this object if None
+        :param n_bins: number of equal-frequency bins genes are discretized into before MIM,
+                       None if genes are already discrete
         """
         self._mim_size = mim_size
         self._pop_size = pop_size
@@ -151,6 +295,22 @@ class MIMAGA(object):
         self._k2 = k2
         self._k3 = k3
         self._k4 = k4
+        self._n_jobs = n_jobs if n_jobs is not None else os.cpu_count()
+        self._pool = None
+        self._fitness_cache = OrderedDict()
+        self._seed = seed
+        self._rng = np.random.default_rng(seed)
+        self._reject_percentile = reject_percentile
+        self._revisit_every = revisit_every
+        self._mi_selected = None
+        self._mi_cache = {}
+        self._n_bins = n_bins
+        if memory is None:
+            self._genes_mutual_information = genes_mutual_information
+        else:
+            if not isinstance(memory, Memory):
+                memory = Memory(location=memory, verbose=0)
+            self._genes_mutual_information = memory.cache(genes_mutual_information)
 
     # MIM
 
@@ -160,9 +320,15 @@ class MIMAGA(object):
         :return: sequence of feature indexes with minimum MI
         """
         g_num, _ = genes.shape
-        mi_vector = genes_mutual_information(genes)
+        if self._n_bins is not None:
+            genes = discretize_genes(genes, self._n_bins)
+        key = _array_key(genes)
+        if key not in self._mi_cache:
+            self._mi_cache[key] = self._genes_mutual_information(genes)
+        mi_vector = self._mi_cache[key]
         seq_nums = [i for i in range(g_num)]
-        target_sequence = list(map(lambda p: p[1], sorted(zip(mi_vector, seq_nums))))[:self.mim_size]
+        target_sequence = list(map(lambda p: p[1], sorted(zip(mi_vector, seq_nums))))[:self._mim_size]
+        self._mi_selected = np.asarray(mi_vector)[target_sequence]
         return target_sequence
 
     # AGA
@@ -171,12 +337,7 @@ class MIMAGA(object):
         :return: initial population
         P.S. each individual corresponds to chromosome
         """
-        population = []
-        for _ in range(self._pop_size):
-            individual_num = random.randint(1, 2 << self._mim_size - 1)
-            individual_code = list(map(int, bin(individual_num)[2:].zfill(self._mim_size)))
-            population.append(individual_code)
-        return population
+        return self._rng.integers(0, 2, size=(self._pop_size, self._mim_size), dtype=np.uint8)
 
     def _crossover_probability(self, f_max, f_avg, f_par):
         """ probability of crossover in population """
@@ -198,31 +359,40 @@ class MIMAGA(object):
         """
         :param max_size: maximum size of population (if population becomes bigger,
                          the worst individuals are killed)
-        :param mapping: mapping from mim-filter index to initial index in dataset
+        :param mapping: array of initial dataset indexes for every mim-filter index
         :param population: vector of chromosomes
-        :param train: train set of initial dataset
+        :param train: standardized train set of initial dataset, samples are rows
         :param train_cl: class distribution of initial train dataset
-        :param test: test set of initial dataset
+        :param test: standardized test set of initial dataset, samples are rows
         :param test_cl: class distribution of initial test dataset
         :return: best individual (sequence of features), it's fitness value
         """
         f_par = f_max = 0
         counter = 0
-        best_individual = [1 for _ in range(len(population[0]))]
+        population = list(population)
+        best_individual = np.ones(len(population[0]), dtype=np.uint8)
         while counter < self._max_iter and f_max < self._f_target:
-            code_fitness, f_max, f_avg = population_fitness(mapping, population, train, train_cl, test, test_cl)
+            revisit = self._revisit_every is not None and counter % self._revisit_every == self._revisit_every - 1
+            reject_percentile = None if revisit else self._reject_percentile
+            code_fitness, f_max, f_avg, rejected = population_fitness(mapping, population, train, train_cl,
+                                                                      test, test_cl, self._pool,
+                                                                      self._fitness_cache,
+                                                                      scores=self._mi_selected,
+                                                                      reject_percentile=reject_percentile)
+            fitness = np.fromiter((p[1] for p in code_fitness), dtype=np.float64, count=len(code_fitness))
+            best_individual = code_fitness[fitness.argmax()][0]
             if len(code_fitness) > max_size:
-                code_fitness = code_fitness[:max_size]
-                population = list(map(lambda x: x[0], code_fitness))
+                fittest = np.argpartition(-fitness, max_size - 1)[:max_size]
+                code_fitness = [code_fitness[i] for i in fittest]
+                population = [p[0] for p in code_fitness] + rejected
 
             highly_fitted = list(filter(lambda x: x[1] >= f_max / 2, code_fitness))
             if len(highly_fitted) == 0:
                 highly_fitted = code_fitness
-            best_individual = code_fitness[0][0]
 
             pc = self._crossover_probability(f_max, f_avg, f_par)
             pm = self._mutation_probability(f_max, f_avg, f_par)
-            new_generation, f_par = cross_and_mutate(pc, pm, highly_fitted)
+            new_generation, f_par = cross_and_mutate(pc, pm, highly_fitted, self._rng)
             population = population + new_generation
             counter += 1
         return best_individual, f_max
@@ -234,16 +404,30 @@ class MIMAGA(object):
         :param classes: distribution pf initial dataset
         :return: filtered with MIMAGA dataset, fitness value
         """
-        genes_T = genes.transpose()
-        train_set, test_set, train_classes, test_classes = train_test_split(genes_T, classes, test_size=0.33)
+        train_set, test_set, train_classes, test_classes = train_test_split(genes.transpose(), classes,
+                                                                            test_size=0.33,
+                                                                            random_state=self._seed)
+        train_set, test_set = np.ascontiguousarray(train_set), np.ascontiguousarray(test_set)
         filtered_indexes = self._mim_filter(train_set.transpose())
-        index_map = dict(zip([i for i in range(self._mim_size)], filtered_indexes))
+        index_map = np.asarray(filtered_indexes, dtype=np.intp)
+
+        # scaling is per feature, so the full sets are standardized once for every chromosome
+        scaler = StandardScaler().fit(train_set)
+        train_std, test_std = scaler.transform(train_set), scaler.transform(test_set)
 
+        self._fitness_cache.clear()  # fitness values are only valid for the current split
         first_population = self._initial_population()
-        best, max_fitness = self._aga_filter(self._pop_size * 2, index_map, first_population,
-                                             train_set.transpose(), train_classes, test_set.transpose(), test_classes)
-        result_genes, _ = decode_genes(index_map, best, train_set.transpose(), test_set.transpose())
-        return result_genes, max_fitness
+        if self._n_jobs > 1:
+            self._pool = _make_pool(self._n_jobs, (index_map, train_std, train_classes, test_std, test_classes))
+        try:
+            best, max_fitness = self._aga_filter(self._pop_size * 2, index_map, first_population,
+                                                 train_std, train_classes, test_std, test_classes)
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+        result_genes, _ = decode_genes(index_map, best, train_set, test_set)
+        return result_genes.transpose(), max_fitness
 
 
 # mimaga = MIMAGA(30, 20, 20, 0.8, 0.6, 0.3, 0.9, 0.001)
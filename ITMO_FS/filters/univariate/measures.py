@@ -5,7 +5,6 @@ from math import log
 import numpy as np
 from scipy import sparse as sp
 
-from ITMO_FS.utils.data_check import generate_features
 from ITMO_FS.utils.information_theory import conditional_entropy
 from ITMO_FS.utils.information_theory import entropy
 from ITMO_FS.utils.qpfs_body import qpfs_body
@@ -13,35 +12,31 @@ from ITMO_FS.utils.qpfs_body import qpfs_body
 
 def fit_criterion_measure(X, y):
     x = np.asarray(X)  # Converting input data to numpy array
-    y = np.asarray(y.reshape((-1,)))
-    if len(x.shape) == 2:
-        fc = np.zeros(x.shape[1])  # Array with amounts of correct predictions for each feature
-    else:
-        fc = np.zeros(len(x))
-    tokens_n = np.unique(y)  # Number of different class tokens
-    centers = np.empty(tokens_n)  # Array with centers of sets of feature values for each class token
-    variances = np.empty(tokens_n)  # Array with variances of sets of feature values for each class token
-    # Each of arrays above will be separately calculated for each feature
-    distances = np.empty(tokens_n)  # Array with distances between sample's value and each class's center
-    # This array will be separately calculated for each feature and each sample
-    for feature_index, feature in enumerate(x.T):  # For each feature
-        # Initializing utility structures
-        class_values = [[] for _ in range(tokens_n)]  # Array with lists of feature values for each class token
-        for index, value in enumerate(y):  # Filling array
-            class_values[value].append(feature[index])
-        for token, values in enumerate(class_values):  # For each class token's list of feature values
-            tmp_arr = np.array(values)
-            centers[token] = np.mean(tmp_arr)
-            variances[token] = np.var(tmp_arr)
-        # Main calculations
-        for sample_index, value in enumerate(feature):  # For each sample value
-            for i in range(tokens_n):  # For each class token
-                # Here can be raise warnings by 0/0 division. In this case, default results
-                # are interpreted correctly
-                distances[i] = np.abs(value - centers[i]) / variances[i]
-            fc[feature_index] += np.argmin(distances) == y[sample_index]
-    fc /= y.shape[0]
-    return dict(zip(generate_features(x), fc))
+    if len(x.shape) == 1:
+        x = x.reshape((-1, 1))
+    _, y = np.unique(np.asarray(y).reshape((-1,)), return_inverse=True)  # Class tokens as 0..tokens_n-1
+    tokens_n = y.max() + 1  # Number of different class tokens
+    n_samples, n_features = x.shape
+    counts = np.bincount(y, minlength=tokens_n)
+    # Centers and variances of sets of feature values for each class token, shape (n_features, tokens_n)
+    centers = np.zeros((n_features, tokens_n))
+    np.add.at(centers.T, y, x)
+    centers /= counts
+    variances = np.zeros((n_features, tokens_n))
+    np.add.at(variances.T, y, (x - centers.T[y]) ** 2)
+    variances /= counts
+    fc = np.empty(n_features)  # Array with amounts of correct predictions for each feature
+    # Features are processed in blocks to keep (block, n_samples, tokens_n) distance tensor small
+    block = max(1, (1 << 22) // (n_samples * tokens_n))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Here can be 0/0 division. In this case, default results are interpreted correctly
+        for start in range(0, n_features, block):
+            stop = min(start + block, n_features)
+            distances = np.abs(x.T[start:stop, :, None] - centers[start:stop, None, :]) \
+                        / variances[start:stop, None, :]
+            fc[start:stop] = (distances.argmin(axis=2) == y).sum(axis=1)
+    fc /= n_samples
+    return fc
 
 
 def __calculate_F_ratio(row, y_data):
@@ -12,7 +12,7 @@ URL = 'https://github.com/LastShekel/ITMO_FS'
 LICENSE = 'new BSD'
 DOWNLOAD_URL = 'https://github.com/LastShekel/ITMO_FS'
 VERSION = '0.3.0'
-INSTALL_REQUIRES = ['numpy', 'scipy', 'scikit-learn', 'imblearn', 'qpsolvers']
+INSTALL_REQUIRES = ['numpy', 'scipy', 'scikit-learn', 'joblib', 'imblearn', 'qpsolvers']
 CLASSIFIERS = ['Intended Audience :: Science/Research',
                'Intended Audience :: Developers',
                'License :: OSI Approved',
@@ -37,7 +37,9 @@ EXTRAS_REQUIRE = {
         'sphinx_rtd_theme',
         'numpydoc',
         'matplotlib'
-    ]
+    ],
+    'numba': [
+        'numba']
 }
 
 setup(name=DISTNAME,
@@ -31,6 +31,13 @@ class TestCases(unittest.TestCase):
             assert (f(data[0], data[0]) == np.ones(data.shape[1])).all()
             # res = UnivariateFilter(f, select_k_best(5)).fit_transform(data, target)
 
+    def test_fit_criterion(self):
+        data, target = load_iris(return_X_y=True)
+        scores = fit_criterion_measure(data, target)
+        assert isinstance(scores, np.ndarray) and scores.shape == (data.shape[1],)
+        res = UnivariateFilter(fit_criterion_measure, select_k_best(2)).fit_transform(data, target)
+        assert res.shape[1] == 2
+
     # def test_filters(self):
     #     data, target = self.wide_classification[0], self.wide_classification[1]
     #     for f, answer in zip(
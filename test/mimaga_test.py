@@ -0,0 +1,60 @@
+import unittest
+from collections import OrderedDict
+
+import numpy as np
+from sklearn.datasets import make_classification
+from sklearn.metrics import mutual_info_score
+
+from ITMO_FS.filters.multivariate.mimaga import *
+from ITMO_FS.filters.multivariate.mimaga import _encode, _mi_matrix, _mi_matrix_numpy
+
+
+class TestCases(unittest.TestCase):
+    data, target = make_classification(n_samples=60, n_features=8, n_informative=4, random_state=0)
+
+    def test_fitness_cache_eviction(self):
+        mapping = np.arange(self.data.shape[1])
+        train, test = self.data[:40], self.data[40:]
+        train_cl, test_cl = self.target[:40], self.target[40:]
+        population = [np.eye(8, dtype=np.uint8)[i] + np.eye(8, dtype=np.uint8)[i + 1] for i in range(5)]
+        cache = OrderedDict()
+        first, _, _, _ = population_fitness(mapping, population, train, train_cl, test, test_cl,
+                                            cache=cache, cache_size=2)
+        second, _, _, _ = population_fitness(mapping, population, train, train_cl, test, test_cl,
+                                              cache=cache, cache_size=2)
+        assert len(cache) == 2
+        assert [f for _, f in first] == [f for _, f in second]
+
+    def test_reject_by_surrogate(self):
+        mapping = np.arange(self.data.shape[1])
+        train, test = self.data[:40], self.data[40:]
+        train_cl, test_cl = self.target[:40], self.target[40:]
+        population = [np.ones(8, dtype=np.uint8), np.eye(8, dtype=np.uint8)[0]]
+        cache = OrderedDict()
+        code_fitness, _, _, rejected = population_fitness(mapping, population, train, train_cl, test, test_cl,
+                                                          cache=cache, scores=np.ones(8), reject_percentile=50)
+        assert [len(code_fitness), len(rejected)] == [1, 1]
+        assert rejected[0] is population[1] and len(cache) == 1
+        assert MIMAGA(4, 4, 1, 1., 0.6, 0.3, 0.9, 0.001)._reject_percentile is None
+
+    def test_mi_matrix_implementations(self):
+        genes = np.random.RandomState(0).randint(0, 5, (6, 40))
+        codes = np.array([_encode(gene) for gene in genes])
+        cards = (codes.max(axis=1) + 1).astype(np.int32)
+        entropies = np.array([marginal_entropy(code) for code in codes])
+        assert np.allclose(_mi_matrix(codes, cards, entropies), _mi_matrix_numpy(codes, cards, entropies))
+
+    def test_mutual_information(self):
+        x, y = np.random.RandomState(0).randint(0, 4, (2, 200))
+        assert np.isclose(mutual_information(x, y), mutual_info_score(x, y))
+        assert np.isclose(mutual_information(x - 1.5, y * 10), mutual_info_score(x, y))
+        assert np.isclose(marginal_entropy(x), mutual_info_score(x, x))
+
+    def test_discretize_genes(self):
+        genes = self.data.T
+        binned = discretize_genes(genes, 32)
+        assert binned.dtype == np.uint8 and binned.shape == genes.shape
+        assert binned.min() >= 0 and binned.max() < 32
+        mimaga = MIMAGA(4, 4, 1, 1., 0.6, 0.3, 0.9, 0.001, n_bins=None)
+        mimaga._mim_filter(genes)
+        assert np.allclose(mimaga._mi_selected, np.sort(genes_mutual_information(genes))[:4])